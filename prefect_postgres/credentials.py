@@ -1,11 +1,51 @@
 """
 Module containing functionality for authenticating with PostgreSQL databases
 """
-from typing import Any, Dict
+import asyncio
+import functools
+import logging
+import re
+import threading
+import warnings
+from contextlib import asynccontextmanager
+from typing import (
+    Any,
+    AsyncContextManager,
+    AsyncIterator,
+    ClassVar,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import psycopg
+from cachetools import TTLCache
 from prefect.blocks.core import Block
-from pydantic import Field, SecretStr
+from psycopg import sql
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+from pydantic import Field, PrivateAttr, SecretStr, root_validator, validator
+
+logger = logging.getLogger(__name__)
+
+# the max_connections setting of a PostgreSQL server left at its default
+DEFAULT_MAX_CONNECTIONS = 100
+
+# TCP keepalive settings used unless overridden in connect_args, so idle
+# pooled connections are not silently dropped by NAT gateways or firewalls
+DEFAULT_KEEPALIVE_ARGS = {
+    "keepalives": 1,
+    "keepalives_idle": 60,
+    "keepalives_interval": 15,
+    "keepalives_count": 3,
+}
+# libpq only knows tcp_user_timeout since version 12
+if psycopg.pq.version() >= 120000:
+    DEFAULT_KEEPALIVE_ARGS["tcp_user_timeout"] = 30000
 
 
 class PostgresDatabaseCredentials(Block):
@@ -18,64 +58,515 @@ class PostgresDatabaseCredentials(Block):
         host: The host address of the database.
         port: The port to connect to the database.
         connect_args: The options which will be passed directly to the
-           psycopg connect() method as additional keyword arguments.
+           psycopg connect() method as additional keyword arguments. The
+           TCP keepalive options in `DEFAULT_KEEPALIVE_ARGS` are added so
+           idle pooled connections stay open behind NAT gateways; set an
+           option to `None` to leave it out, or `keepalives` to 0 to turn
+           keepalives off.
+        prepare_threshold: The number of times a query is executed before it
+            is prepared server-side; `None` disables prepared statements.
+        prepared_statements: Statements, by name, prepared server-side on each
+            new connection so they can be run with `EXECUTE name(...)`. Since
+            psycopg binds parameters server-side by default, which `EXECUTE`
+            does not accept, run them with a `psycopg.AsyncClientCursor` or
+            pass the values as `psycopg.sql.Literal`.
+        pool_min_size: The minimum number of connections kept open in the pool.
+        pool_max_size: The maximum number of connections the pool will open.
+        pool_timeout: The number of seconds to wait for a connection from the
+            pool before raising an error.
+        pool_max_idle: The number of seconds a connection can stay idle in the
+            pool before it is closed, down to `pool_min_size` connections.
+        cache_ttl: The number of seconds results of `cached_fetch` are kept.
+        cache_maxsize: The maximum number of results `cached_fetch` keeps.
+            Results are shared by all blocks connecting to the same database
+            with the same `connect_args`; the cache settings of the first of
+            them to fetch apply.
+    Pool sizing:
+        A pool is shared by all blocks with the same settings running on the
+        same event loop, so `pool_max_size` bounds the connections opened by
+        each event loop of a worker.
+        A handful of connections per CPU core of the database server is
+        usually enough; as a starting point, around 25 connections serve up
+        to 100 concurrent tasks and around 50 serve 500. Larger pools add
+        contention on the server rather than throughput. Keep
+        `pool_max_size` multiplied by the number of workers below the
+        server's `max_connections`, which defaults to 100.
     Example:
         Load stored database credentials:
         ```python
-        from prefect_postgres import DatabaseCredentials
-        database_block = DatabaseCredentials.load("BLOCK_NAME")
+        from prefect_postgres.credentials import PostgresDatabaseCredentials
+        database_block = PostgresDatabaseCredentials.load("BLOCK_NAME")
+        ```
+
+        Run a statement prepared on each new connection:
+        ```python
+        import psycopg
+        from prefect_postgres.credentials import PostgresDatabaseCredentials
+        database_block = PostgresDatabaseCredentials(
+            database="postgres",
+            host="localhost",
+            port=5432,
+            prepared_statements={"get_flag": "SELECT * FROM flags WHERE id = $1"},
+        )
+        async with database_block.connection() as conn:
+            # client-side binding quotes the parameters into the EXECUTE
+            cursor = psycopg.AsyncClientCursor(conn)
+            await cursor.execute("EXECUTE get_flag(%s)", (42,))
+            rows = await cursor.fetchall()
         ```
     """
 
     _block_type_name = "Postgres Database Credentials"
     _logo_url = "https://images.ctfassets.net/gm98wzqotmnx/7G8c2Zz4j0yyhXqQ44SI2A/eee9ba482dd6b61862b588b6fd28ad81/PostgreSQL-Logo.png?h=250"  # noqa
 
-    username: str = Field(default=None, description="The name of the database to use.")
-    password: SecretStr = Field(
+    username: Optional[str] = Field(
+        default=None, description="The name of the database to use."
+    )
+    password: Optional[SecretStr] = Field(
         default=None, description="The user name used to authenticate."
     )
     database: str = Field(default=..., description="The password used to authenticate.")
     host: str = Field(default=..., description="The host address of the database.")
-    port: str = Field(default=..., description="The port to connect to the database.")
+    port: int = Field(
+        default=...,
+        ge=1,
+        le=65535,
+        description="The port to connect to the database.",
+    )
     connect_args: Dict[str, Any] = Field(
         default_factory=dict,
         title="Additional Configuration",
         description="Additional configuration to use when creating a "
         "database connection.",
     )
+    prepare_threshold: Optional[int] = Field(
+        default=5,
+        description="The number of times a query is executed before it is "
+        "prepared server-side; leave empty to disable prepared statements.",
+    )
+    prepared_statements: Dict[str, str] = Field(
+        default_factory=dict,
+        description="Statements, by name, prepared server-side on each new "
+        "connection so they can be run with EXECUTE name(...) from a "
+        "client-side binding cursor.",
+    )
+    pool_min_size: int = Field(
+        default=1,
+        ge=0,
+        description="The minimum number of connections kept open in the pool.",
+    )
+    pool_max_size: int = Field(
+        default=10,
+        ge=1,
+        description="The maximum number of connections the pool will open.",
+    )
+    pool_timeout: float = Field(
+        default=30.0,
+        gt=0,
+        description="The number of seconds to wait for a connection from the "
+        "pool before raising an error.",
+    )
+    pool_max_idle: float = Field(
+        default=600.0,
+        gt=0,
+        description="The number of seconds a connection can stay idle in the "
+        "pool before it is closed.",
+    )
+    cache_ttl: float = Field(
+        default=60.0,
+        gt=0,
+        description="The number of seconds results of cached queries are kept.",
+    )
+    cache_maxsize: int = Field(
+        default=1024,
+        ge=1,
+        description="The maximum number of cached query results kept.",
+    )
+
+    # pools are shared by every block with the same connection settings, so
+    # reloading the block in each task run does not open new connections;
+    # they are tracked per event loop since a pool cannot outlive its loop,
+    # and closed by a task the loop cancels when it shuts down
+    _pools: ClassVar[
+        Dict[asyncio.AbstractEventLoop, Dict[Tuple, AsyncConnectionPool]]
+    ] = {}
+    _pool_closers: ClassVar[Dict[asyncio.AbstractEventLoop, asyncio.Task]] = {}
+    _pools_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    # results of cached_fetch, shared by every block reading the same data,
+    # and the queries currently running to fill them, per event loop
+    _result_caches: ClassVar[Dict[Tuple, TTLCache]] = {}
+    _pending_fetches: ClassVar[Dict[Tuple, asyncio.Future]] = {}
+    _result_caches_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    # holds the unwrapped password, so it must never be a field
+    _conninfo: Optional[str] = PrivateAttr(default=None)
+    _conninfo_params: Optional[Tuple] = PrivateAttr(default=None)
+    _conninfo_password: Optional[SecretStr] = PrivateAttr(default=None)
+
+    @validator("port", pre=True)
+    def _strip_port(cls, value: Any) -> Any:
+        """
+        Strips whitespace from ports stored as strings by earlier versions
+        of this block.
+        """
+        if isinstance(value, str):
+            return value.strip()
+        return value
+
+    @root_validator(skip_on_failure=True)
+    def _check_pool_size(cls, values: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Ensures the pool sizes are consistent.
+        """
+        if values["pool_min_size"] > values["pool_max_size"]:
+            raise ValueError("pool_min_size must not be greater than pool_max_size")
+        return values
+
+    def block_initialization(self) -> None:
+        """
+        Warns about pools larger than a default PostgreSQL server accepts.
+        This is done here rather than in a validator so the warning points
+        at the code creating the block.
+        """
+        if self.pool_max_size > DEFAULT_MAX_CONNECTIONS:
+            warnings.warn(
+                f"pool_max_size of {self.pool_max_size} is greater than the "
+                f"default PostgreSQL max_connections of {DEFAULT_MAX_CONNECTIONS}; "
+                "make sure the server accepts this many connections from every "
+                "worker.",
+                stacklevel=3,
+            )
+
+    def _get_conninfo(self) -> str:
+        """
+        Returns the libpq connection string of this block. It is only rebuilt,
+        unwrapping the password, when a connection field changed since the
+        last call.
+        """
+        params = (self.database, self.username, self.host, self.port)
+        # SecretStr is immutable, so a new password is always a new object
+        if (
+            params != self._conninfo_params
+            or self.password is not self._conninfo_password
+        ):
+            self._conninfo = make_conninfo(
+                dbname=self.database,
+                user=self.username,
+                password=self.password.get_secret_value() if self.password else None,
+                host=self.host,
+                port=self.port,
+            )
+            self._conninfo_params = params
+            self._conninfo_password = self.password
+        return self._conninfo
+
+    @staticmethod
+    async def _configure_connection(
+        conn: psycopg.AsyncConnection,
+        prepare_threshold: Optional[int],
+        prepared_statements: Dict[str, str],
+    ) -> None:
+        """
+        Configures each new connection opened by the pool, with the settings
+        of the block that created it.
+        """
+        conn.prepare_threshold = prepare_threshold
+        if prepared_statements:
+            for name, statement in prepared_statements.items():
+                await conn.execute(
+                    sql.SQL("PREPARE {} AS {}").format(
+                        sql.Identifier(name), sql.SQL(statement)
+                    )
+                )
+            # the pool only accepts connections left idle by this callback
+            await conn.commit()
+
+    @staticmethod
+    def _reconnect_failed(pool: AsyncConnectionPool) -> None:
+        """
+        Reports a pool that gave up trying to reconnect to the database.
+        """
+        logger.error(
+            "Connection pool %s failed to reconnect to the database for %s "
+            "seconds; new connections will be attempted on demand.",
+            pool.name,
+            pool.reconnect_timeout,
+        )
+
+    @classmethod
+    async def _close_pools_on_shutdown(cls, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Waits until the event loop cancels it when shutting down, as
+        `asyncio.run` does with pending tasks, then closes the pools opened
+        on that loop.
+        """
+        try:
+            await loop.create_future()
+        finally:
+            with cls._pools_lock:
+                pools = cls._pools.pop(loop, {})
+                cls._pool_closers.pop(loop, None)
+            for pool in pools.values():
+                await pool.close()
+
+    def _get_connect_kwargs(self) -> Dict[str, Any]:
+        """
+        Returns the keyword arguments of each new connection: the default
+        keepalive options updated with `connect_args`, without the options
+        set to `None` there.
+        """
+        kwargs = {**DEFAULT_KEEPALIVE_ARGS, **self.connect_args}
+        return {key: value for key, value in kwargs.items() if value is not None}
+
+    def _get_settings_key(self) -> Tuple:
+        """
+        Returns a key identifying the settings that affect the connections
+        of this block, and so the pool and cached results it can share.
+        """
+        return (
+            self._get_conninfo(),
+            repr(sorted(self.connect_args.items())),
+            self.prepare_threshold,
+            repr(sorted(self.prepared_statements.items())),
+            self.pool_min_size,
+            self.pool_max_size,
+            self.pool_timeout,
+            self.pool_max_idle,
+        )
+
+    async def _get_pool(self) -> AsyncConnectionPool:
+        """
+        Returns the connection pool matching the settings of this block,
+        creating and opening it on first use.
+        """
+        key = self._get_settings_key()
+        loop = asyncio.get_running_loop()
+        with self._pools_lock:
+            # loops closed without cancelling their tasks never ran the
+            # closer; drop their pools so the connections can be collected
+            for closed_loop in [other for other in self._pools if other.is_closed()]:
+                del self._pools[closed_loop]
+                self._pool_closers.pop(closed_loop, None)
+
+            if loop not in self._pools:
+                self._pools[loop] = {}
+                self._pool_closers[loop] = loop.create_task(
+                    self._close_pools_on_shutdown(loop)
+                )
+            pools = self._pools[loop]
+            pool = pools.get(key)
+            if pool is None:
+                pool = pools[key] = AsyncConnectionPool(
+                    conninfo=self._get_conninfo(),
+                    kwargs=self._get_connect_kwargs(),
+                    min_size=self.pool_min_size,
+                    max_size=self.pool_max_size,
+                    timeout=self.pool_timeout,
+                    max_idle=self.pool_max_idle,
+                    # the pool is shared and outlives this block, so it must
+                    # not read settings the block may change later
+                    configure=functools.partial(
+                        self._configure_connection,
+                        prepare_threshold=self.prepare_threshold,
+                        prepared_statements=dict(self.prepared_statements),
+                    ),
+                    # replace connections broken while idle before handing
+                    # them out
+                    check=AsyncConnectionPool.check_connection,
+                    reconnect_failed=self._reconnect_failed,
+                    open=False,
+                )
+        # opening an already opened pool is a no-op
+        await pool.open()
+        return pool
 
-    def get_connection(self) -> psycopg.AsyncConnection:
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[psycopg.AsyncConnection]:
         """
-        Returns an authenticated connection object that can be
-        used to query from databases.
+        Returns an authenticated connection that can be used to query from
+        databases. The connection is checked out from a pool shared by blocks
+        with the same settings, and returned to it when the context exits.
         Returns:
             The authenticated Psycopg3 AsyncConnection.
         Examples:
             Create an asynchronous connection to PostgreSQL using URL params.
             ```python
             from prefect import flow
-            from prefect_postgres import DatabaseCredentials
+            from prefect_postgres.credentials import PostgresDatabaseCredentials
             @flow
-            def postgres_credentials_flow():
-                postgres_credentials = DatabaseCredentials(
+            async def postgres_credentials_flow():
+                postgres_credentials = PostgresDatabaseCredentials(
                     username="prefect",
                     password="prefect_password",
                     database="postgres",
                     host="localhost",
                     port=5432
                 )
-                conn = postgres_credentials.get_connection()
-                with conn.cursor() as cur:
-                    cur.execute("CREATE TABLE test
-                    (id serial PRIMARY KEY,num integer,data text)")
+                async with postgres_credentials.connection() as conn:
+                    async with conn.cursor() as cur:
+                        await cur.execute("CREATE TABLE test "
+                        "(id serial PRIMARY KEY,num integer,data text)")
             postgres_credentials_flow()
             ```
         """
-        return psycopg.AsyncConnection.connect(
-            database=self.database,
-            user=self.username,
-            password=self.password,
-            host=self.host,
-            port=self.port,
-            connect_args=self.connect_args,
+        pool = await self._get_pool()
+        async with pool.connection() as conn:
+            yield conn
+
+    def get_connection(self) -> AsyncContextManager[psycopg.AsyncConnection]:
+        """
+        Deprecated alias of `connection`.
+        Returns:
+            An async context manager yielding a pooled Psycopg3 AsyncConnection.
+        """
+        warnings.warn(
+            "PostgresDatabaseCredentials.get_connection is deprecated, "
+            "use PostgresDatabaseCredentials.connection instead.",
+            DeprecationWarning,
+            stacklevel=2,
         )
+        return self.connection()
+
+    @asynccontextmanager
+    async def pipeline(self) -> AsyncIterator[psycopg.AsyncConnection]:
+        """
+        Returns a pooled connection in pipeline mode, where statements are sent
+        to the server without waiting for the result of the previous one. This
+        is the preferred entry point for bulk inserts and updates.
+        Returns:
+            The authenticated Psycopg3 AsyncConnection, in pipeline mode.
+        Examples:
+            Insert many rows in a single round trip.
+            ```python
+            from prefect import flow
+            from prefect_postgres.credentials import PostgresDatabaseCredentials
+            @flow
+            async def postgres_pipeline_flow():
+                postgres_credentials = PostgresDatabaseCredentials.load("BLOCK_NAME")
+                async with postgres_credentials.pipeline() as conn:
+                    for num in range(100):
+                        await conn.execute(
+                            "INSERT INTO test (num) VALUES (%s)", (num,)
+                        )
+            postgres_pipeline_flow()
+            ```
+        """
+        async with self.connection() as conn:
+            async with conn.pipeline():
+                yield conn
+
+    def _get_result_cache_key(self) -> Tuple:
+        """
+        Returns a key identifying the data this block reads, unlike
+        `_get_settings_key` ignoring settings that do not change results.
+        """
+        return (self._get_conninfo(), repr(sorted(self.connect_args.items())))
+
+    def _get_result_cache(self) -> TTLCache:
+        """
+        Returns the result cache for the data this block reads.
+        Must be called with the result caches lock held.
+        """
+        key = self._get_result_cache_key()
+        cache = self._result_caches.get(key)
+        if cache is None:
+            cache = self._result_caches[key] = TTLCache(
+                maxsize=self.cache_maxsize, ttl=self.cache_ttl
+            )
+        return cache
+
+    async def cached_fetch(
+        self,
+        query: str,
+        params: Optional[Union[Sequence[Any], Mapping[str, Any]]] = None,
+    ) -> List[Tuple[Any, ...]]:
+        """
+        Fetches all rows of a read-only query, reusing the result of an
+        identical query run within the last `cache_ttl` seconds. Only use
+        this for queries whose results can be stale for that long, and call
+        `invalidate_cache` after writing to the tables they read. Concurrent
+        calls for the same query on the same event loop wait for a single
+        execution instead of each running it.
+        Args:
+            query: The query to run.
+            params: The parameters of the query; they must be hashable.
+        Returns:
+            The rows returned by the query.
+        Examples:
+            Look up a small dimension table on every task run.
+            ```python
+            from prefect import task
+            from prefect_postgres.credentials import PostgresDatabaseCredentials
+            @task
+            async def get_country(code):
+                postgres_credentials = PostgresDatabaseCredentials.load("BLOCK_NAME")
+                rows = await postgres_credentials.cached_fetch(
+                    "SELECT name FROM countries WHERE code = %s", (code,)
+                )
+                return rows[0][0]
+            ```
+        """
+        if isinstance(params, Mapping):
+            params_key = tuple(sorted(params.items()))
+        else:
+            params_key = tuple(params or ())
+        key = (query, params_key)
+
+        loop = asyncio.get_running_loop()
+        pending_key = (loop, self._get_result_cache_key(), key)
+        with self._result_caches_lock:
+            rows = self._get_result_cache().get(key)
+            pending = self._pending_fetches.get(pending_key)
+            if rows is None and pending is None:
+                pending = self._pending_fetches[pending_key] = loop.create_future()
+                running = True
+            else:
+                running = False
+        if rows is not None:
+            return list(rows)
+
+        if not running:
+            try:
+                return list(await asyncio.shield(pending))
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # the call running the query was cancelled, so run it here
+                return await self.cached_fetch(query, params)
+
+        try:
+            async with self.connection() as conn:
+                cursor = await conn.execute(query, params)
+                rows = await cursor.fetchall()
+            with self._result_caches_lock:
+                self._get_result_cache()[key] = rows
+            pending.set_result(rows)
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except Exception as exc:
+            pending.set_exception(exc)
+            # mark the exception as retrieved when nobody was waiting for it
+            pending.exception()
+            raise
+        finally:
+            with self._result_caches_lock:
+                self._pending_fetches.pop(pending_key, None)
+        return list(rows)
+
+    def invalidate_cache(self, pattern: Optional[str] = None) -> None:
+        """
+        Removes results of `cached_fetch` from the cache, for every block
+        reading the same data as this one.
+        Args:
+            pattern: A regular expression; only results of queries matching it
+                are removed. If not provided, all results are removed.
+        """
+        with self._result_caches_lock:
+            cache = self._get_result_cache()
+            if pattern is None:
+                cache.clear()
+                return
+            for key in [key for key in cache if re.search(pattern, key[0])]:
+                cache.pop(key, None)
@@ -1,2 +1,401 @@
-def test_placeholder():
-    pass
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+import psycopg
+import pytest
+from psycopg import sql
+from psycopg.conninfo import conninfo_to_dict
+from pydantic import SecretStr
+
+from prefect_postgres.credentials import PostgresDatabaseCredentials
+
+
+class MockAsyncConnection:
+    prepare_threshold = 5
+
+    def __init__(self):
+        self.in_pipeline = False
+        self.executed = []
+        self.commits = 0
+
+    async def execute(self, query, params=None):
+        self.executed.append((query, params))
+        await asyncio.sleep(0)
+        if query == "SELECT broken":
+            raise psycopg.errors.SyntaxError("broken")
+        return self
+
+    async def commit(self):
+        self.commits += 1
+
+    async def fetchall(self):
+        return [(len(self.executed),)]
+
+    @asynccontextmanager
+    async def pipeline(self):
+        self.in_pipeline = True
+        yield
+        self.in_pipeline = False
+
+
+class MockAsyncConnectionPool:
+    def __init__(self, conninfo="", **kwargs):
+        self.conninfo = conninfo
+        self.kwargs = kwargs
+        self.opened = False
+        self.closed = False
+        self.connections = 0
+        self.conn = MockAsyncConnection()
+
+    @staticmethod
+    async def check_connection(conn):
+        pass
+
+    async def open(self):
+        self.opened = True
+
+    async def close(self):
+        self.closed = True
+
+    @asynccontextmanager
+    async def connection(self):
+        self.connections += 1
+        yield self.conn
+
+
+@pytest.fixture
+def mock_pool(monkeypatch):
+    monkeypatch.setattr(
+        "prefect_postgres.credentials.AsyncConnectionPool", MockAsyncConnectionPool
+    )
+
+
+@pytest.fixture(autouse=True)
+def clear_registries():
+    yield
+    PostgresDatabaseCredentials._pools.clear()
+    PostgresDatabaseCredentials._pool_closers.clear()
+    PostgresDatabaseCredentials._result_caches.clear()
+    PostgresDatabaseCredentials._pending_fetches.clear()
+
+
+@pytest.fixture
+def credentials():
+    return PostgresDatabaseCredentials(
+        username="prefect",
+        password="prefect_password",
+        database="postgres",
+        host="localhost",
+        port=5432,
+    )
+
+
+@pytest.fixture
+def server_credentials():
+    """
+    Credentials of a real PostgreSQL server, given as a libpq connection
+    string in PREFECT_POSTGRES_TEST_CONNINFO; tests using it are skipped
+    when it is not set.
+    """
+    conninfo = os.environ.get("PREFECT_POSTGRES_TEST_CONNINFO")
+    if not conninfo:
+        pytest.skip("PREFECT_POSTGRES_TEST_CONNINFO is not set")
+    params = conninfo_to_dict(conninfo)
+    return PostgresDatabaseCredentials(
+        username=params.get("user"),
+        password=params.get("password"),
+        database=params.get("dbname", "postgres"),
+        host=params.get("host", "localhost"),
+        port=params.get("port", 5432),
+    )
+
+
+@pytest.mark.parametrize("port", [5432, "5432", " 5432 "])
+def test_port_coerced_to_int(port):
+    credentials = PostgresDatabaseCredentials(
+        database="postgres", host="localhost", port=port
+    )
+    assert credentials.port == 5432
+
+
+@pytest.mark.parametrize("port", [0, 65536, "not-a-port"])
+def test_port_invalid(port):
+    with pytest.raises(ValueError):
+        PostgresDatabaseCredentials(database="postgres", host="localhost", port=port)
+
+
+def test_pool_min_size_greater_than_max_size():
+    with pytest.raises(ValueError, match="pool_min_size"):
+        PostgresDatabaseCredentials(
+            database="postgres",
+            host="localhost",
+            port=5432,
+            pool_min_size=5,
+            pool_max_size=2,
+        )
+
+
+@pytest.mark.parametrize("field", ["pool_timeout", "pool_max_idle"])
+@pytest.mark.parametrize("value", [0, -1])
+def test_pool_durations_must_be_positive(field, value):
+    with pytest.raises(ValueError, match=field):
+        PostgresDatabaseCredentials(
+            database="postgres", host="localhost", port=5432, **{field: value}
+        )
+
+
+def test_pool_max_size_warns_above_max_connections():
+    with pytest.warns(UserWarning, match="max_connections") as record:
+        PostgresDatabaseCredentials(
+            database="postgres", host="localhost", port=5432, pool_max_size=200
+        )
+    assert record[0].filename == __file__
+
+
+def test_password_unwrapped_but_not_exposed(credentials):
+    assert "password=prefect_password" in credentials._get_conninfo()
+    assert "prefect_password" not in repr(credentials)
+    assert "prefect_password" not in str(credentials.dict())
+
+
+def test_password_optional():
+    credentials = PostgresDatabaseCredentials(
+        database="postgres", host="localhost", port=5432
+    )
+    assert "password" not in credentials._get_conninfo()
+
+
+def test_password_unwrapped_once(credentials, monkeypatch):
+    conninfo = credentials._get_conninfo()
+
+    def fail():
+        raise AssertionError("password unwrapped again")
+
+    monkeypatch.setattr(credentials.password, "get_secret_value", fail)
+    assert credentials._get_conninfo() is conninfo
+
+
+async def test_conninfo_follows_field_changes(mock_pool, credentials):
+    pool = await credentials._get_pool()
+    credentials.host = "other"
+    credentials.password = SecretStr("other_password")
+
+    assert "host=other" in credentials._get_conninfo()
+    assert "password=other_password" in credentials._get_conninfo()
+    assert await credentials._get_pool() is not pool
+
+
+async def test_connection_reuses_pool(mock_pool, credentials):
+    async with credentials.connection() as conn:
+        assert conn is (await credentials._get_pool()).conn
+    async with credentials.connection():
+        pass
+
+    pool = await credentials._get_pool()
+    assert pool.opened
+    assert pool.connections == 2
+    assert pool.kwargs["min_size"] == 1
+    assert pool.kwargs["max_size"] == 10
+    assert pool.kwargs["timeout"] == 30.0
+    assert pool.kwargs["max_idle"] == 600.0
+    assert pool.kwargs["check"] is MockAsyncConnectionPool.check_connection
+    assert "password=prefect_password" in pool.conninfo
+    assert "dbname=postgres" in pool.conninfo
+
+
+async def test_connection_passes_connect_args(mock_pool, credentials):
+    credentials.connect_args = {"sslmode": "disable", "application_name": "test"}
+    credentials.prepare_threshold = None
+    async with credentials.connection():
+        pass
+
+    pool = await credentials._get_pool()
+    assert pool.kwargs["kwargs"]["sslmode"] == "disable"
+    assert pool.kwargs["kwargs"]["application_name"] == "test"
+
+    conn = MockAsyncConnection()
+    await pool.kwargs["configure"](conn)
+    assert conn.prepare_threshold is None
+
+
+async def test_connection_keepalives(mock_pool, credentials):
+    credentials.connect_args = {"keepalives_idle": 300}
+    pool = await credentials._get_pool()
+    assert pool.kwargs["kwargs"]["keepalives"] == 1
+    assert pool.kwargs["kwargs"]["keepalives_idle"] == 300
+
+
+async def test_connection_keepalive_defaults_removable(mock_pool, credentials):
+    credentials.connect_args = {"tcp_user_timeout": None, "keepalives_count": None}
+    pool = await credentials._get_pool()
+    assert "tcp_user_timeout" not in pool.kwargs["kwargs"]
+    assert "keepalives_count" not in pool.kwargs["kwargs"]
+    assert pool.kwargs["kwargs"]["keepalives"] == 1
+
+
+async def test_connection_prepared_statements(mock_pool, credentials):
+    credentials.prepared_statements = {"get_flag": "SELECT * FROM flags WHERE id = $1"}
+    pool = await credentials._get_pool()
+
+    conn = MockAsyncConnection()
+    await pool.kwargs["configure"](conn)
+    assert conn.executed == [
+        (
+            sql.SQL("PREPARE {} AS {}").format(
+                sql.Identifier("get_flag"),
+                sql.SQL("SELECT * FROM flags WHERE id = $1"),
+            ),
+            None,
+        )
+    ]
+    assert conn.commits == 1
+
+
+async def test_pool_configure_ignores_later_block_changes(mock_pool, credentials):
+    credentials.prepared_statements = {"get_flag": "SELECT 1"}
+    pool = await credentials._get_pool()
+    credentials.prepare_threshold = None
+    credentials.prepared_statements = {"get_other": "SELECT 2"}
+    assert await credentials._get_pool() is not pool
+
+    conn = MockAsyncConnection()
+    await pool.kwargs["configure"](conn)
+    assert conn.prepare_threshold == 5
+    assert conn.executed == [
+        (
+            sql.SQL("PREPARE {} AS {}").format(
+                sql.Identifier("get_flag"), sql.SQL("SELECT 1")
+            ),
+            None,
+        )
+    ]
+
+
+@pytest.mark.parametrize("pipeline", [False, True], ids=["connection", "pipeline"])
+async def test_prepared_statements_execute(server_credentials, pipeline):
+    server_credentials.prepared_statements = {"plus_one": "SELECT $1::int + 1"}
+    connection = (
+        server_credentials.pipeline() if pipeline else server_credentials.connection()
+    )
+    async with connection as conn:
+        cursor = psycopg.AsyncClientCursor(conn)
+        await cursor.execute("EXECUTE plus_one(%s)", (41,))
+        assert await cursor.fetchall() == [(42,)]
+
+        cursor = await conn.execute(
+            sql.SQL("EXECUTE plus_one({})").format(sql.Literal(1))
+        )
+        assert await cursor.fetchall() == [(2,)]
+
+
+async def test_get_connection_deprecated(mock_pool, credentials):
+    with pytest.warns(DeprecationWarning, match="connection instead"):
+        async with credentials.get_connection() as conn:
+            assert conn is (await credentials._get_pool()).conn
+
+
+async def test_pipeline(mock_pool, credentials):
+    async with credentials.pipeline() as conn:
+        assert conn.in_pipeline
+    assert not conn.in_pipeline
+    assert (await credentials._get_pool()).connections == 1
+
+
+async def test_pool_shared_between_blocks(mock_pool, credentials):
+    same_credentials = PostgresDatabaseCredentials(**credentials.dict())
+    other_credentials = PostgresDatabaseCredentials(
+        **{**credentials.dict(), "database": "other"}
+    )
+
+    pool = await credentials._get_pool()
+    assert await same_credentials._get_pool() is pool
+    assert await other_credentials._get_pool() is not pool
+
+
+def test_pools_closed_with_event_loop(mock_pool, credentials):
+    pools = []
+    for _ in range(2):
+        pools.append(asyncio.run(credentials._get_pool()))
+        assert PostgresDatabaseCredentials._pools == {}
+        assert PostgresDatabaseCredentials._pool_closers == {}
+
+    assert pools[0] is not pools[1]
+    assert all(pool.closed for pool in pools)
+
+
+def test_pools_of_closed_event_loop_dropped(mock_pool, credentials):
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(credentials._get_pool())
+    # closed without cancelling pending tasks, unlike asyncio.run
+    loop.close()
+
+    asyncio.run(credentials._get_pool())
+    assert loop not in PostgresDatabaseCredentials._pools
+    assert loop not in PostgresDatabaseCredentials._pool_closers
+
+
+async def test_cached_fetch(mock_pool, credentials):
+    sql = "SELECT * FROM flags WHERE name = %s"
+    assert await credentials.cached_fetch(sql, ("a",)) == [(1,)]
+    assert await credentials.cached_fetch(sql, ("a",)) == [(1,)]
+    assert await credentials.cached_fetch(sql, ("b",)) == [(2,)]
+
+    conn = (await credentials._get_pool()).conn
+    assert conn.executed == [(sql, ("a",)), (sql, ("b",))]
+
+
+async def test_invalidate_cache(mock_pool, credentials):
+    await credentials.cached_fetch("SELECT * FROM flags")
+    await credentials.cached_fetch("SELECT * FROM countries")
+
+    credentials.invalidate_cache("flags")
+    assert await credentials.cached_fetch("SELECT * FROM flags") == [(3,)]
+    assert await credentials.cached_fetch("SELECT * FROM countries") == [(2,)]
+
+    credentials.invalidate_cache()
+    assert await credentials.cached_fetch("SELECT * FROM countries") == [(4,)]
+
+
+async def test_cached_fetch_not_shared_across_connect_args(mock_pool, credentials):
+    other_credentials = PostgresDatabaseCredentials(
+        **{**credentials.dict(), "connect_args": {"options": "-c search_path=b"}}
+    )
+    assert await credentials.cached_fetch("SHOW search_path") == [(1,)]
+    assert await other_credentials.cached_fetch("SHOW search_path") == [(1,)]
+
+    other_conn = (await other_credentials._get_pool()).conn
+    assert other_conn.executed == [("SHOW search_path", None)]
+
+
+async def test_invalidate_cache_shared_across_pool_settings(mock_pool, credentials):
+    writer_credentials = PostgresDatabaseCredentials(
+        **{**credentials.dict(), "pool_max_size": 2}
+    )
+    assert await credentials.cached_fetch("SELECT * FROM flags") == [(1,)]
+    assert await writer_credentials.cached_fetch("SELECT * FROM flags") == [(1,)]
+
+    writer_credentials.invalidate_cache("flags")
+    assert await credentials.cached_fetch("SELECT * FROM flags") == [(2,)]
+
+
+async def test_cached_fetch_concurrent_misses_run_once(mock_pool, credentials):
+    results = await asyncio.gather(
+        *(credentials.cached_fetch("SELECT * FROM flags") for _ in range(5))
+    )
+    assert results == [[(1,)]] * 5
+
+    conn = (await credentials._get_pool()).conn
+    assert len(conn.executed) == 1
+    assert PostgresDatabaseCredentials._pending_fetches == {}
+
+
+async def test_cached_fetch_concurrent_misses_share_errors(mock_pool, credentials):
+    results = await asyncio.gather(
+        *(credentials.cached_fetch("SELECT broken") for _ in range(3)),
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, psycopg.errors.SyntaxError) for result in results)
+
+    conn = (await credentials._get_pool()).conn
+    assert len(conn.executed) == 1